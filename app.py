@@ -1,14 +1,21 @@
 # pip install streamlit fbprophet yfinance plotly
+import glob
+import hashlib
+import os
+import tempfile
 import streamlit as st
 from datetime import date
 
+import numpy as np
+import pandas as pd
 import yfinance as yf
-from prophet import Prophet
-from prophet.plot import plot_plotly
 from plotly import graph_objs as go
 
 START = "2018-01-01"
 TODAY = date.today().strftime("%Y-%m-%d")
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+PRICE_COLUMNS = ("Open", "High", "Low", "Close", "Adj Close")
+MAX_PLOT_POINTS = 2000
 
 st.title('Stock Forecast App')
 
@@ -19,38 +26,149 @@ n_years = st.slider('Years of prediction:', 1, 4)
 period = n_years * 365
 
 
-@st.cache
-def load_data(ticker):
-    data = yf.download(ticker, START, TODAY)
+def write_cache_file(path, write, mode="wb"):
+    """Atomically write a file into CACHE_DIR and drop older entries of its kind.
+
+    Siblings sharing the part of the file name before the last "_" (the
+    ticker, and the start date for prices) are removed, so each ticker keeps
+    only its latest file.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    prefix, ext = os.path.splitext(path)
+    for old in glob.glob(glob.escape(prefix.rsplit("_", 1)[0]) + "_*" + ext):
+        if old != path:
+            remove_cache_file(old)
+
+
+def remove_cache_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+@st.cache_data(ttl=24 * 60 * 60)
+def load_data(ticker, start, end):
+    # Daily prices only change once a day, so keep a copy on disk keyed by
+    # date; restarts and other workers can then skip the Yahoo round trip.
+    path = os.path.join(CACHE_DIR, f"{ticker}_{start}_{end}.pkl")
+    if os.path.exists(path):
+        try:
+            return pd.read_pickle(path)
+        except Exception:
+            # Unreadable cache entry; discard it and download again.
+            remove_cache_file(path)
+    data = yf.download(ticker, start, end)
     data.reset_index(inplace=True)
+    # Prices only carry a few significant digits; float32 halves the frame.
+    data = data.astype({col: "float32" for col in PRICE_COLUMNS if col in data})
+    if not data.empty:
+        write_cache_file(path, data.to_pickle)
     return data
 
 	
 data_load_state = st.text('Loading data...')
-data = load_data(selected_stock)
+data = load_data(selected_stock, START, TODAY)
 data_load_state.text('Loading data... done!')
 
 st.subheader('Raw data')
 st.write(data.tail())
 
+def lttb_indices(y, n_out):
+    """Pick n_out positions of y that keep its shape (Largest-Triangle-Three-Buckets)."""
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    y = np.asarray(y, dtype=np.float64)
+    x = np.arange(n, dtype=np.float64)
+    # First and last points are always kept; the rest is split into n_out - 2 buckets.
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_lo, next_hi = edges[i + 1], edges[i + 2]
+        else:
+            next_lo, next_hi = n - 1, n
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        idx[i + 1] = a
+    return idx
+
+
+# The bucket loop costs ~25 ms per trace, so run it once per loaded frame
+# rather than on every rerun.
+@st.cache_data(max_entries=len(stocks) * 2)
+def plot_indices(ticker, start, end, _data):
+    return lttb_indices(_data['Open'], MAX_PLOT_POINTS), lttb_indices(_data['Close'], MAX_PLOT_POINTS)
+
+
 # Plot raw data
 def plot_raw_data():
 	fig = go.Figure()
-	fig.add_trace(go.Scatter(x=data['Date'], y=data['Open'], name="stock_open"))
-	fig.add_trace(go.Scatter(x=data['Date'], y=data['Close'], name="stock_close"))
+	open_idx, close_idx = plot_indices(selected_stock, START, TODAY, data)
+	fig.add_traces([
+		go.Scatter(x=data['Date'].iloc[open_idx], y=data['Open'].iloc[open_idx], name="stock_open"),
+		go.Scatter(x=data['Date'].iloc[close_idx], y=data['Close'].iloc[close_idx], name="stock_close"),
+	])
 	fig.layout.update(title_text='Time Series data with Rangeslider', xaxis_rangeslider_visible=True)
 	st.plotly_chart(fig)
 	
 plot_raw_data()
 
-# Predict forecast with Prophet.
+# Predict forecast with Prophet. Imported here rather than at the top so the
+# raw data renders before Prophet and its Stan backend finish loading.
+from prophet import Prophet
+from prophet.plot import plot_plotly
+from prophet.serialize import model_from_json, model_to_json
+
+
+# Both caches key on a digest of the training frame instead of the frame
+# itself, so an unchanged series reuses the fitted model and moving the
+# years slider only re-runs the cheap predict step.
+@st.cache_resource(max_entries=len(stocks))
+def fit_prophet(ticker, train_hash, _df_train):
+    # The fitted model is also written to disk so restarts and other workers
+    # load it instead of re-running the Stan fit.
+    path = os.path.join(CACHE_DIR, f"prophet_{ticker}_{train_hash}.json")
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                return model_from_json(f.read())
+        except Exception:
+            # Unreadable cache entry; discard it and fit again.
+            remove_cache_file(path)
+    m = Prophet()
+    m.fit(_df_train)
+    model_json = model_to_json(m)
+    write_cache_file(path, lambda f: f.write(model_json), mode="w")
+    return m
+
+
+@st.cache_data(max_entries=len(stocks) * 4)
+def predict_prophet(ticker, train_hash, period, _m):
+    future = _m.make_future_dataframe(periods=period)
+    return _m.predict(future)
+
+
 df_train = data[['Date','Close']]
 df_train = df_train.rename(columns={"Date": "ds", "Close": "y"})
+train_hash = hashlib.md5(pd.util.hash_pandas_object(df_train, index=False).to_numpy().tobytes()).hexdigest()
 
-m = Prophet()
-m.fit(df_train)
-future = m.make_future_dataframe(periods=period)
-forecast = m.predict(future)
+m = fit_prophet(selected_stock, train_hash, df_train)
+forecast = predict_prophet(selected_stock, train_hash, period, m)
 
 # Show and plot forecast
 st.subheader('Forecast data')